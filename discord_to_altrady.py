@@ -19,11 +19,16 @@ Discord → Altrady Signal-Forwarder (Multi-Block + Leg-Filter + Futures-Touch +
   * Trend-Match optional
 """
 
-import os, re, sys, time, json, traceback
+import os, re, sys, time, socket, signal, logging, hashlib, threading
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
 from pathlib import Path
-from datetime import datetime
+from types import MappingProxyType
 
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -48,6 +53,8 @@ COIN_LEV_CAPS = {
     "LUNA2": int(os.getenv("LEV_MAX_LUNA2", "50")),
     "LUNA":  int(os.getenv("LEV_MAX_LUNA",  "50")),
 }
+# Globaler + coin-spezifischer Cap vorab zusammengefasst → pro Signal ein min()
+LEV_CAP_BY_BASE = {b: min(cap, MAX_LEVERAGE) for b, cap in COIN_LEV_CAPS.items()}
 
 TP_SPLITS_RAW = os.getenv("TP_SPLITS", "40,60").strip()  # Default 40/60
 ENTRY_EXPIRATION_MIN = int(os.getenv("ENTRY_EXPIRATION_MIN", "10"))
@@ -55,6 +62,8 @@ ENTRY_EXPIRATION_MIN = int(os.getenv("ENTRY_EXPIRATION_MIN", "10"))
 POLL_BASE   = int(os.getenv("POLL_BASE_SECONDS", "60"))
 POLL_OFFSET = int(os.getenv("POLL_OFFSET_SECONDS", "3"))
 STATE_FILE  = Path(os.getenv("STATE_FILE", "state.json"))
+STATE_TMP   = STATE_FILE.with_name(STATE_FILE.name + ".tmp")
+SENT_CACHE_MAX = 1000  # zuletzt gesendete Order-Keys im State (Schutz vor Doppel-Order nach Neustart)
 
 # --- LEG-FILTER ENVs ---
 LEG_FILTER              = os.getenv("LEG_FILTER", "on").lower() == "on"
@@ -65,12 +74,19 @@ LEG_MAX_LOOKBACK        = int(os.getenv("LEG_MAX_LOOKBACK", "400"))
 LEG_REQUIRE_TREND_MATCH = os.getenv("LEG_REQUIRE_TREND_MATCH", "on").lower() == "on"
 LEG_FAIL_MODE           = os.getenv("LEG_FAIL_MODE", "skip").lower()  # "skip" | "open"
 TF_MAP = {"M5": "5m", "M15": "15m", "H1": "1h", "1D": "1d"}
+LEG_IDX_CAP = 5  # infer_trend_and_leg zählt Legs max. bis 5
+# Ohne Trend-Match, mit LEG_MAX >= Cap und FAIL-OPEN kann der Filter nie ablehnen → Klines sparen
+# (bei LEG_FAIL_MODE=skip lehnt ein fehlgeschlagener Klines-Fetch ab, z. B. ohne Spot-Markt)
+LEG_CAN_REJECT = LEG_REQUIRE_TREND_MATCH or LEG_MAX < LEG_IDX_CAP or LEG_FAIL_MODE == "skip"
 
 # --- WAIT-FOR-TOUCH ENVs ---
 ENTRY_WAIT_MAX_SEC      = int(os.getenv("ENTRY_WAIT_MAX_SEC", "1200"))  # M5 default: 20m
 ENTRY_POLL_SEC          = float(os.getenv("ENTRY_POLL_SEC", "1"))
 ENTRY_TOL_PCT           = float(os.getenv("ENTRY_TOL_PCT", "0.05"))     # 0.05% = 5 bps
 ENTRY_TOUCH_ORDER_TYPE  = os.getenv("ENTRY_TOUCH_ORDER_TYPE", "limit").lower()  # limit | market
+# Spätester Order-Zeitpunkt ab Post-Zeit des Signals. Default 2× Wait: eine durch Touch-Waits
+# blockierte Poll-Runde + ein volles Touch-Wait (wie bisher maximal möglich)
+SIGNAL_MAX_AGE_SEC      = int(os.getenv("SIGNAL_MAX_AGE_SEC", str(2 * ENTRY_WAIT_MAX_SEC)))
 
 # --- BASIS/ADJUST ENVs ---
 # adjust: hole Spot & Futures, skaliere Level 1x mit fut/spot (cap via BASIS_MAX_PCT), Touch am Futures
@@ -79,15 +95,81 @@ ENTRY_TOUCH_ORDER_TYPE  = os.getenv("ENTRY_TOUCH_ORDER_TYPE", "limit").lower()
 BASIS_MODE     = os.getenv("BASIS_MODE", "adjust").lower()  # adjust | spot | off
 BASIS_MAX_PCT  = float(os.getenv("BASIS_MAX_PCT", "0.30"))  # Max 0.30% Skalierung
 
+# --- NETZ ENVs ---
+DNS_CACHE_SEC  = float(os.getenv("DNS_CACHE_SEC", "300"))  # 0 = aus
+SIGNAL_WORKERS = max(1, int(os.getenv("SIGNAL_WORKERS", "4")))  # parallele Signal-Blöcke
+CONNECT_TIMEOUT = 3.05  # s; TCP-Connect kurz halten, Read-Timeout je nach Endpoint
+DISCORD_MAX_BODY = 2 << 20  # Bytes; 25 Messages inkl. Embeds liegen weit darunter
+
+# --- LOG ENVs ---
+LOG_LEVEL      = os.getenv("LOG_LEVEL", "INFO").upper()  # DEBUG zeigt Idle-Ticks + Block-Rohtext
+
+# Ein Formatter mit Zeitstempel für alle Zeilen; Level-Gating statt print pro Tick.
+# Root bleibt auf WARNING, damit urllib3-Debug nicht mitläuft.
+logging.basicConfig(format="[%(asctime)s] %(message)s", datefmt="%H:%M:%S", stream=sys.stdout)
+log = logging.getLogger("d2a")
+log.setLevel(LOG_LEVEL)
+
 # Sanity-Check
 if not DISCORD_TOKEN or not CHANNEL_ID or not ALTRADY_WEBHOOK_URL:
-    print("Bitte ENV setzen: DISCORD_TOKEN, CHANNEL_ID, ALTRADY_WEBHOOK_URL (und Keys).")
+    log.error("Bitte ENV setzen: DISCORD_TOKEN, CHANNEL_ID, ALTRADY_WEBHOOK_URL (und Keys).")
     sys.exit(1)
 
 HEADERS = {
     "Authorization": DISCORD_TOKEN,   # User-Session
     "User-Agent": "DiscordToAltrady/1.5"
 }
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Eine Session für alle Hosts (Discord, Binance Spot/Futures, Altrady) → Keep-Alive statt
+# neuem TCP/TLS-Handshake pro Call. Discord-Token bleibt bewusst per-Call (HEADERS).
+SESSION = requests.Session()
+SESSION.headers["User-Agent"] = HEADERS["User-Agent"]
+# Discord- und Klines-GETs sind idempotent: transiente 429/5xx/Verbindungsfehler im Adapter wiederholen
+# (0s, 1s, 2s + Jitter, Retry-After wird beachtet), statt den Tick bzw. Leg-Check zu verlieren.
+# Ticker-Polls (Touch-Wait) bewusst ohne Retry: ein Backoff würde den Poll-Takt verschleppen,
+# ein verlorener Poll wird ohnehin im nächsten Intervall nachgeholt.
+API_RETRY = Retry(
+    total=3, backoff_factor=0.5, backoff_max=8, backoff_jitter=0.25,
+    status_forcelist=(408, 425, 429, 500, 502, 503, 504),
+    allowed_methods=frozenset({"GET"}), respect_retry_after_header=True, raise_on_status=False,
+)
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=0))
+for _prefix in ("https://discord.com/api/", "https://api.binance.com/api/v3/klines"):
+    SESSION.mount(_prefix, HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=API_RETRY))
+# Altrady-Webhook: Retries (429/5xx/Verbindungsfehler, Retry-After) im Connection-Pool statt Python-Schleife.
+# Exponentiell (0s, 2s, 4s; max 16s) + Jitter, damit parallele Blöcke nicht im Gleichtakt erneut feuern.
+ALTRADY_RETRY = Retry(
+    total=3, backoff_factor=1.0, backoff_max=16, backoff_jitter=0.5,
+    status_forcelist=(429, 500, 502, 503, 504),
+    allowed_methods=frozenset({"POST"}), respect_retry_after_header=True, raise_on_status=False,
+)
+SESSION.mount(ALTRADY_WEBHOOK_URL, HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=ALTRADY_RETRY))
+
+# DNS-Cache mit TTL: neue Pool-Verbindungen (Reconnect, Touch-Polls) sparen sich den Resolver
+_DNS_CACHE: dict = {}
+_sys_getaddrinfo = socket.getaddrinfo
+
+def _cached_getaddrinfo(*args, **kwargs):
+    key = (args, tuple(sorted(kwargs.items())))
+    now = time.monotonic()
+    hit = _DNS_CACHE.get(key)
+    if hit and now - hit[0] < DNS_CACHE_SEC: return hit[1]
+    res = _sys_getaddrinfo(*args, **kwargs)
+    _DNS_CACHE[key] = (now, res)
+    return res
+
+if DNS_CACHE_SEC > 0:
+    socket.getaddrinfo = _cached_getaddrinfo
+
+# Kleiner Pool, um unabhängige Requests (z. B. Spot- + Futures-Preis) zu überlappen
+IO_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="io")
+# Signal-Blöcke einer Message laufen parallel (eigener Pool, da sie selbst auf IO_POOL warten)
+BLOCK_POOL = ThreadPoolExecutor(max_workers=SIGNAL_WORKERS, thread_name_prefix="block")
+# State wird von Block-Workern (Sent-Cache) und Poll-Loop (last_id) geschrieben
+STATE_LOCK = threading.Lock()
+# Shutdown-Flag (SIGINT/SIGTERM): alle Wartestellen schlafen per STOP.wait und wachen sofort auf
+STOP = threading.Event()
 
 # =========================
 # Helpers / Exceptions
@@ -96,93 +178,170 @@ HEADERS = {
 class SkipSignal(Exception):
     pass
 
+class ParseError(Exception):
+    pass
+
 def parse_tp_splits(raw: str) -> tuple[int,int]:
-    try:
-        a,b = [int(float(x.strip())) for x in raw.split(",")]
-        if a <= 0 or b <= 0 or a+b != 100: raise ValueError
-        return a,b
-    except Exception:
-        print(f"[WARN] Ungültige TP_SPLITS='{raw}', Fallback 40,60.")
-        return 40,60
+    parts = raw.split(",")
+    if len(parts) == 2:
+        try: a,b = int(float(parts[0])), int(float(parts[1]))
+        except (ValueError, OverflowError): a = b = 0
+        if a > 0 and b > 0 and a+b == 100:
+            return a,b
+    log.warning(f"Ungültige TP_SPLITS='{raw}', Fallback 40,60.")
+    return 40,60
 
 TP1_PCT, TP2_PCT = parse_tp_splits(TP_SPLITS_RAW)
 
+_STATE_BLOB = None  # zuletzt gelesener/geschriebener Dateiinhalt
+
 def load_state() -> dict:
+    global _STATE_BLOB
     if STATE_FILE.exists():
-        try: return json.loads(STATE_FILE.read_text(encoding="utf-8"))
+        try:
+            blob = STATE_FILE.read_bytes()
+            state = orjson.loads(blob)
+            _STATE_BLOB = blob
+            return state
         except Exception: pass
     return {"last_id": None}
 
 def save_state(state: dict):
-    tmp = STATE_FILE.with_suffix(".json.tmp")
-    tmp.write_text(json.dumps(state), encoding="utf-8")
-    tmp.replace(STATE_FILE)
+    global _STATE_BLOB
+    blob = orjson.dumps(state)
+    # unveränderter Stand → kein tmp-Write/Rename
+    if blob == _STATE_BLOB: return
+    # ein write()-Syscall auf einem rohen fd, ohne Python-File-Objekt; Rename bleibt für Atomarität.
+    # fsync vor dem Rename, sonst kann nach Stromausfall ein leeres state.json übrig bleiben
+    fd = os.open(STATE_TMP, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.write(fd, blob)
+        os.fsync(fd)
+    finally: os.close(fd)
+    os.replace(STATE_TMP, STATE_FILE)
+    # Verzeichniseintrag (Rename) selbst durablen; best effort, Windows kennt O_DIRECTORY nicht
+    if hasattr(os, "O_DIRECTORY"):
+        try:
+            dfd = os.open(STATE_FILE.parent, os.O_RDONLY | os.O_DIRECTORY)
+            try: os.fsync(dfd)
+            finally: os.close(dfd)
+        except OSError: pass
+    _STATE_BLOB = blob
+
+POLL_BASE_NS   = POLL_BASE * 1_000_000_000
+POLL_OFFSET_NS = POLL_OFFSET * 1_000_000_000
 
 def sleep_until_next_tick():
-    now = time.time()
-    period_start = (now // POLL_BASE) * POLL_BASE
-    next_tick = period_start + POLL_BASE + POLL_OFFSET
-    if now < period_start + POLL_OFFSET:
-        next_tick = period_start + POLL_OFFSET
-    time.sleep(max(0, next_tick - now))
+    # Ganzzahlig in ns: keine Float-Rundung an der Periodengrenze.
+    # Wall-Clock (time_ns) bleibt nötig, da die Ticks an Minutengrenzen ausgerichtet sind.
+    now = time.time_ns()
+    next_tick = now - now % POLL_BASE_NS + POLL_OFFSET_NS
+    if now >= next_tick:
+        next_tick += POLL_BASE_NS
+    # Event.wait misst monoton: Uhrsprünge verschieben den Tick nicht, ein Stop-Signal weckt sofort
+    STOP.wait((next_tick - now) / 1e9)
 
 # =========================
 # Discord
 # =========================
 
-def fetch_latest_message(channel_id: str):
+_DISCORD_NOT_BEFORE: dict[str, float] = {}  # Route → monotone Freigabezeit
+
+def discord_get(url: str, **kw) -> requests.Response:
+    # Bucket-Header proaktiv beachten: ist das Kontingent leer, bis zum Reset warten,
+    # statt erst in den 429 (plus Strafpause) zu laufen
+    wait = _DISCORD_NOT_BEFORE.get(url, 0.0) - time.monotonic()
+    if wait > 0: STOP.wait(wait)
+    r = SESSION.get(url, headers=HEADERS, timeout=(CONNECT_TIMEOUT, 15), **kw)
+    if r.headers.get("X-RateLimit-Remaining") == "0":
+        try: _DISCORD_NOT_BEFORE[url] = time.monotonic() + float(r.headers.get("X-RateLimit-Reset-After", "0"))
+        except ValueError: pass
+    return r
+
+def fetch_channel_messages(channel_id: str, params: dict) -> list[dict]:
     url = f"https://discord.com/api/v10/channels/{channel_id}/messages"
-    r = requests.get(url, headers=HEADERS, params={"limit":1}, timeout=15)
-    if r.status_code == 429:
-        retry = 5
-        try: retry = float(r.json().get("retry_after", 5))
-        except Exception: pass
-        time.sleep(retry + 0.5)
-        r = requests.get(url, headers=HEADERS, params={"limit":1}, timeout=15)
-    r.raise_for_status()
-    data = r.json()
+    # 429 (Retry-After) und 5xx wiederholt bereits der Session-Adapter
+    r = discord_get(url, params=params, stream=True)
+    # Body begrenzt einlesen: übergroße Antworten früh (Content-Length) bzw. beim Lesen abbrechen,
+    # statt sie komplett in den Speicher zu holen
+    with r:
+        if not r.ok:
+            # Fehler-Body (begrenzt) vor dem Schließen lesen und in die Exception packen: `with` schließt
+            # den Stream ungelesen, response.text wäre im [HTTP ERROR]-Log leer
+            err_body = r.raw.read(4096, decode_content=True)
+            raise requests.HTTPError(f"{r.status_code} {err_body[:200]!r}", response=r)
+        if int(r.headers.get("Content-Length") or 0) > DISCORD_MAX_BODY:
+            raise ValueError(f"Discord-Antwort zu groß: {r.headers['Content-Length']} Bytes")
+        body = bytearray()
+        for chunk in r.iter_content(65536):
+            body += chunk
+            if len(body) > DISCORD_MAX_BODY:
+                raise ValueError(f"Discord-Antwort zu groß: > {DISCORD_MAX_BODY} Bytes")
+    return orjson.loads(body)
+
+DISCORD_EPOCH_MS = 1420070400000
+
+def message_time(mid: str) -> float:
+    # Snowflake: obere 42 Bit = ms seit Discord-Epoch → Unix-Sekunden
+    return ((int(mid) >> 22) + DISCORD_EPOCH_MS) / 1000.0
+
+def fetch_latest_message(channel_id: str):
+    data = fetch_channel_messages(channel_id, {"limit": 1})
     return data[0] if data else None
 
-BUYSELL_LINE = re.compile(r"(?im)^\s*.*\b(BUY|SELL)\b.*$")
-
-def extract_signal_blocks(msg: dict) -> list[str]:
-    def source_text():
-        parts = []
-        parts.append((msg.get("content") or "").replace("\r",""))
-        embeds = msg.get("embeds") or []
-        if embeds and isinstance(embeds, list):
-            e0 = embeds[0] or {}
-            desc = (e0.get("description") or "").replace("\r","")
-            if desc: parts.append(desc)
-        return "\n".join([p for p in parts if p]).strip()
-
-    raw = source_text()
-    if not raw: return []
-    starts = [m.start() for m in BUYSELL_LINE.finditer(raw)]
-    if not starts: return []
-
-    blocks = []
-    for i,s in enumerate(starts):
-        tail = raw[s:]
-        chunk = tail[:(starts[i+1]-s)] if i+1 < len(starts) else tail
-        m_blank = re.search(r"\n\s*\n", chunk)
-        if m_blank: chunk = chunk[:m_blank.start()]
-        chunk = re.sub(r"(?im)^\s*Timeframe:.*$", "", chunk).strip()
-        if BUYSELL_LINE.search(chunk):
-            blocks.append(chunk)
-    return blocks
+def fetch_messages_after(channel_id: str, after_id: int, limit: int = 25) -> list[dict]:
+    # Alle seit after_id neuen Messages in einem Request (statt eine pro Tick), chronologisch;
+    # bei > limit folgen die restlichen im nächsten Tick
+    data = fetch_channel_messages(channel_id, {"after": after_id, "limit": limit})
+    return sorted(data, key=lambda m: int(m["id"]))
+
+BUYSELL_LINE   = re.compile(r"(?im)^\s*.*\b(BUY|SELL)\b.*$")
+BUYSELL_WORD   = re.compile(r"(?i)\b(?:BUY|SELL)\b")
+BLOCK_SPLIT    = re.compile(r"(?im)^(?=.*\b(?:BUY|SELL)\b)")
+BLANK_LINE     = re.compile(r"\n\s*\n")
+TIMEFRAME_LINE = re.compile(r"(?im)^\s*Timeframe:.*$")
+WHITESPACE     = re.compile(r"\s+")
+TIMEFRAME_VAL  = re.compile(r"Timeframe:\s*(M5|M15|H1|1D)", re.I)
+
+def message_parts(msg: dict) -> tuple[str, str, str]:
+    # (content, embed-description, embed-footer) – einmal pro Message bauen und am dict cachen;
+    # Block-Extraktion und Timeframe-Suche (pro Block) lesen dieselben Felder
+    parts = msg.get("_parts")
+    if parts is None:
+        desc = footer = ""
+        e = msg.get("embeds") or []
+        if e and isinstance(e, list):
+            e0 = e[0] or {}
+            desc = e0.get("description") or ""
+            ft = e0.get("footer")
+            footer = (ft.get("text") or "") if isinstance(ft, dict) else ""
+        parts = msg["_parts"] = (msg.get("content") or "", desc, footer)
+    return parts
+
+def iter_signal_blocks(msg: dict) -> Iterator[str]:
+    content, desc, _ = message_parts(msg)
+    # Häufigster Fall (kein Signal): ohne BUY/SELL-Wort gar keinen Gesamttext bauen
+    if not (BUYSELL_WORD.search(content) or BUYSELL_WORD.search(desc)): return
+    # \r-Entfernung + strip einmal über den Gesamttext statt pro Teil
+    raw = "\n".join((content, desc)).replace("\r","").strip()
+    # Ein Split-Durchlauf direkt vor jeder BUY/SELL-Zeile; der Lookahead bleibt in seiner Zeile,
+    # führende Leerzeilen gehören damit nicht mehr zum Block (schnitten ihn vorher leer)
+    parts = BLOCK_SPLIT.split(raw)
+
+    # parts[0] = Text vor der ersten BUY/SELL-Zeile (kein Block). split() baut alle Teile vorab,
+    # der Generator filtert sie nur noch (poll_loop materialisiert ohnehin per list())
+    for part in parts[1:]:
+        chunk = BLANK_LINE.split(part, 1)[0]
+        chunk, n_tf = TIMEFRAME_LINE.subn("", chunk)
+        chunk = chunk.strip()
+        # Ein nicht-leerer Chunk beginnt immer mit der BUY/SELL-Zeile; neu prüfen muss man
+        # nur, wenn die Timeframe-Entfernung etwas gelöscht hat.
+        if chunk and (not n_tf or BUYSELL_LINE.search(chunk)):
+            yield chunk
 
 def find_timeframe_in_msg(msg: dict) -> str:
-    parts = []
-    parts.append(msg.get("content") or "")
-    e = (msg.get("embeds") or [])
-    if e and isinstance(e,list):
-        e0 = e[0] or {}
-        parts.append(e0.get("description") or "")
-        ft = (e0.get("footer") or {}).get("text","") if isinstance(e0.get("footer"), dict) else ""
-        if ft: parts.append(ft)
-    txt = "\n".join(parts)
-    m = re.search(r"Timeframe:\s*(M5|M15|H1|1D)", txt, re.I)
+    txt = "\n".join(message_parts(msg))
+    m = TIMEFRAME_VAL.search(txt)
     return (m.group(1).upper() if m else LEG_TIMEFRAME_DEFAULT)
 
 # =========================
@@ -194,31 +353,50 @@ TICK_MAP = {
     "BTC":2,"ETH":2,"BNB":2,"LTC":2,"ADA":5,"MATIC":5,"EOS":4,"BCH":2,
     "ATOM":3,"ALGO":5,"LUNA2":3
 }
-def round_tick(sym: str, v: float) -> float:
-    d = TICK_MAP.get(sym, 4); p = 10**d; return round(v*p)/p
+TICK_FACTORS = {sym: 10**d for sym, d in TICK_MAP.items()}
+TICK_FACTOR_DEFAULT = 10**4
 
-SIG_SIDE  = re.compile(r"\b(BUY|SELL)\b", re.I)
-SIG_PAIR  = re.compile(r"on\s+([A-Z0-9]+)[/\-]([A-Z0-9]+)", re.I)
-NUM       = r"([0-9]*\.?[0-9]+)"
-SIG_ENTRY = re.compile(rf"Price:\s*{NUM}", re.I)
-SIG_TP1   = re.compile(rf"TP\s*1:\s*{NUM}", re.I)
-SIG_TP2   = re.compile(rf"TP\s*2:\s*{NUM}", re.I)
-SIG_SL    = re.compile(rf"\bSL\s*:\s*{NUM}", re.I)
+def round_tick(sym: str, v: float) -> float:
+    p = TICK_FACTORS.get(sym, TICK_FACTOR_DEFAULT); return round(v*p)/p
+
+NUM = r"[0-9]*\.?[0-9]+"
+# Ein Scan statt sechs: pro Feld zählt (wie bei .search) der erste Treffer
+SIG_ALL = re.compile(
+    r"\b(?P<side>BUY|SELL)\b"
+    r"|on\s+(?P<base>[A-Z0-9]+)[/\-](?P<quote>[A-Z0-9]+)"
+    rf"|Price:\s*(?P<entry>{NUM})"
+    rf"|TP\s*1:\s*(?P<tp1>{NUM})"
+    rf"|TP\s*2:\s*(?P<tp2>{NUM})"
+    rf"|\bSL\s*:\s*(?P<sl>{NUM})",
+    re.I,
+)
+SIG_FIELDS = (
+    ("side",  "BUY/SELL nicht gefunden."),
+    ("base",  "Paar (z. B. SOL/USD) nicht gefunden."),
+    ("entry", "Entry nicht gefunden."),
+    ("tp1",   "TP1 nicht gefunden."),
+    ("tp2",   "TP2 nicht gefunden."),
+    ("sl",    "SL nicht gefunden."),
+)
 
 def parse_signal_text(text: str) -> dict:
     t = (text or "").replace("\r","").strip()
-    if not t: raise AssertionError("Leerer Signaltext.")
-    m_side = SIG_SIDE.search(t);   assert m_side, "BUY/SELL nicht gefunden."
-    m_pair = SIG_PAIR.search(t);   assert m_pair, "Paar (z. B. SOL/USD) nicht gefunden."
-    m_e    = SIG_ENTRY.search(t);  assert m_e,    "Entry nicht gefunden."
-    m_tp1  = SIG_TP1.search(t);    assert m_tp1,  "TP1 nicht gefunden."
-    m_tp2  = SIG_TP2.search(t);    assert m_tp2,  "TP2 nicht gefunden."
-    m_sl   = SIG_SL.search(t);     assert m_sl,   "SL nicht gefunden."
-
-    side_raw = m_side.group(1).upper()
+    if not t: raise ParseError("Leerer Signaltext.")
+    found = {}
+    for m in SIG_ALL.finditer(t):
+        key = m.lastgroup if m.lastgroup != "quote" else "base"
+        if key not in found:
+            found[key] = m
+            if len(found) == len(SIG_FIELDS): break
+    missing = [err for key, err in SIG_FIELDS if key not in found]
+    if missing: raise ParseError(" ".join(missing))
+    m_side, m_pair = found["side"], found["base"]
+    m_e, m_tp1, m_tp2, m_sl = found["entry"], found["tp1"], found["tp2"], found["sl"]
+
+    side_raw = m_side.group("side").upper()
     side = "long" if side_raw == "BUY" else "short"
-    base = m_pair.group(1).upper()
-    quoted_raw = m_pair.group(2).upper()
+    base = m_pair.group("base").upper()
+    quoted_raw = m_pair.group("quote").upper()
     if quoted_raw not in ("USD","USDT"):
         raise SkipSignal(f"Non-USD Quote erkannt: {base}/{quoted_raw}")
 
@@ -227,23 +405,23 @@ def parse_signal_text(text: str) -> dict:
     if base == "SHIB": base = "1000SHIB"
     quoted = "USDT"
 
-    entry = float(m_e.group(1))
-    tp1   = float(m_tp1.group(1))
-    tp2   = float(m_tp2.group(1))
-    sl    = float(m_sl.group(1))
+    entry = float(m_e.group("entry"))
+    tp1   = float(m_tp1.group("tp1"))
+    tp2   = float(m_tp2.group("tp2"))
+    sl    = float(m_sl.group("sl"))
 
     if side == "long" and not (sl < entry and tp1 > entry and tp2 > entry):
         raise ValueError("Long: TP/SL nicht plausibel.")
     if side == "short" and not (sl > entry and tp1 < entry and tp2 < entry):
         raise ValueError("Short: TP/SL nicht plausibel.")
 
-    sl_pct = ((entry - sl)/entry*100.0) if side=="long" else ((sl - entry)/entry*100.0)
-    lev = int(SAFETY_PCT // max(sl_pct, 1e-12))
-    lev = max(1, min(lev, MAX_LEVERAGE))
-    coin_cap = COIN_LEV_CAPS.get(base)
-    if coin_cap is not None: lev = min(lev, coin_cap)
+    # SL liegt nach der Plausi-Prüfung immer auf der Verlustseite → Betrag statt Seitenweiche
+    sl_pct = abs(entry - sl)/entry*100.0
+    lev = min(LEV_CAP_BY_BASE.get(base, MAX_LEVERAGE), max(1, int(SAFETY_PCT // max(sl_pct, 1e-12))))
 
     symbol = f"{ALTRADY_EXCHANGE}_{QUOTE}_{base}"
+    # Binance-Daten (Klines/Ticker) einmal hier ableiten statt pro Fetch/Poll
+    market_base = market_base_for_data(base)
 
     # Spot-Level zunächst runden – Adjust folgt (falls aktiv)
     entry = round_tick(base, entry)
@@ -254,7 +432,8 @@ def parse_signal_text(text: str) -> dict:
     return {
         "side": side, "base": base, "quote_from_signal": quoted,
         "entry": entry, "tp1": tp1, "tp2": tp2, "sl": sl,
-        "sl_pct": float(f"{sl_pct:.6f}"), "leverage": lev, "symbol": symbol
+        "sl_pct": float(f"{sl_pct:.6f}"), "leverage": lev, "symbol": symbol,
+        "market_base": market_base, "binance_symbol": f"{market_base}USDT",
     }
 
 # =========================
@@ -264,122 +443,165 @@ def parse_signal_text(text: str) -> dict:
 def market_base_for_data(base: str) -> str:
     return "LUNA" if base=="LUNA2" else base
 
-def fetch_klines_binance_spot(base: str, quote: str, interval: str, limit: int):
+def fetch_closes_binance_spot(base: str, quote: str, interval: str, limit: int) -> list[float]:
     sym = f"{base}{quote}"
     url = "https://api.binance.com/api/v3/klines"
-    r = requests.get(url, params={"symbol":sym,"interval":interval,"limit":limit}, timeout=10)
+    r = SESSION.get(url, params={"symbol":sym,"interval":interval,"limit":limit}, timeout=(CONNECT_TIMEOUT, 10))
     r.raise_for_status()
-    data = r.json()
-    out = []
-    for k in data:
-        o,h,l,c = float(k[1]), float(k[2]), float(k[3]), float(k[4])
-        out.append((o,h,l,c))
-    return out
+    # Leg-Filter braucht nur Close (Index 4) → kein OHLC-Tupel, 1 statt 4 float() pro Kerze
+    return [float(k[4]) for k in orjson.loads(r.content)]
+
+# Klines-Cache pro (Base, Intervall): innerhalb einer Kerzenlänge teilen sich alle Blöcke
+# und Folge-Ticks dieselbe Serie. Ticker-Preise werden bewusst NICHT gecacht (Touch braucht Live-Preise).
+# Letzte Kline ist die noch offene Kerze → ihr Close lebt; nur kurz (Minuten-Bucket) cachen
+CLOSES_BUCKET_SEC = 60
+CLOSES_PURGE_SEC  = 300
+# key → [bucket, closes, (trend, leg) | None]; Leg-Ergebnis lebt und verfällt mit seinen Closes
+_CLOSES_CACHE: dict[tuple, list] = {}
+
+def closes_cache_entry(base: str, quote: str, interval: str, limit: int) -> list:
+    # Mehrere Signale/Blöcke in derselben Minute teilen sich einen Kline-Request
+    now = int(time.time())
+    bucket = now // CLOSES_BUCKET_SEC
+    key = (base, quote, interval, limit)
+    hit = _CLOSES_CACHE.get(key)
+    if hit and hit[0] == bucket:
+        return hit
+    entry = [bucket, fetch_closes_binance_spot(base, quote, interval, limit), None]
+    # Einträge älter als CLOSES_PURGE_SEC verwerfen, sonst wächst der Cache mit jedem neuen Symbol
+    for k, e in list(_CLOSES_CACHE.items()):
+        if now - e[0] * CLOSES_BUCKET_SEC >= CLOSES_PURGE_SEC: _CLOSES_CACHE.pop(k, None)
+    _CLOSES_CACHE[key] = entry
+    return entry
 
 def zigzag_pivots(closes, pct: float):
     if not closes: return []
-    thr = pct / 100.0
+    thr = pct / 100.0; neg_thr = -thr
     piv = []; last_i=0; last_v=closes[0]; direction=0
+    # eine Division pro Bar: down == -up (IEEE-exakt), Close nur einmal indizieren
     for i in range(1,len(closes)):
-        up   = (closes[i]-last_v)/last_v
-        down = (last_v-closes[i])/last_v
+        c = closes[i]
+        move = (c-last_v)/last_v
         if direction >= 0:
-            if up >= thr:
-                piv.append(last_i); direction=1; last_i=i; last_v=closes[i]
-            elif closes[i] < last_v:
-                last_i=i; last_v=closes[i]
+            if move >= thr:
+                if not piv or piv[-1] != last_i: piv.append(last_i)
+                direction=1; last_i=i; last_v=c
+            elif c < last_v:
+                last_i=i; last_v=c
         if direction <= 0:
-            if down >= thr:
-                piv.append(last_i); direction=-1; last_i=i; last_v=closes[i]
-            elif closes[i] > last_v:
-                last_i=i; last_v=closes[i]
-    if last_i not in piv: piv.append(last_i)
-    return sorted(set(piv))
+            if move <= neg_thr:
+                if not piv or piv[-1] != last_i: piv.append(last_i)
+                direction=-1; last_i=i; last_v=c
+            elif c > last_v:
+                last_i=i; last_v=c
+    # last_i fällt nie → piv bleibt sortiert; Duplikate werden schon beim Anhängen verworfen
+    if not piv or piv[-1] != last_i: piv.append(last_i)
+    return piv
 
 def infer_trend_and_leg(closes, pivots):
     if len(pivots) < 3: return "unknown", 1
     recent = pivots[-10:]
     last, prev = recent[-1], recent[-2]
     trend = "up" if closes[last] > closes[prev] else "down"
-    start = recent[0]
+    # Pivots sind streng aufsteigend → Anzahl ab Leg-Start = Restlänge ab dessen Position
+    start = 0
     for i in range(2,len(recent)):
         a,b,c = recent[i-2], recent[i-1], recent[i]
         if trend=="up":
-            if closes[a] < closes[b] and closes[c] > closes[b]: start=b; break
+            if closes[a] < closes[b] and closes[c] > closes[b]: start=i-1; break
         else:
-            if closes[a] > closes[b] and closes[c] < closes[b]: start=b; break
-    count = sum(1 for p in recent if p >= start)
-    leg_idx = max(1, min(5, count))
+            if closes[a] > closes[b] and closes[c] < closes[b]: start=i-1; break
+    count = len(recent) - start
+    leg_idx = max(1, min(LEG_IDX_CAP, count))
     return trend, leg_idx
 
+def leg_analysis_cached(base: str, quote: str, interval: str, limit: int) -> tuple[str, int]:
+    # ZigZag + Leg einmal pro gecachter Closes-Serie; weitere Signale im selben Bucket lesen das Ergebnis
+    entry = closes_cache_entry(base, quote, interval, limit)
+    if entry[2] is None:
+        closes = entry[1]
+        entry[2] = infer_trend_and_leg(closes, zigzag_pivots(closes, LEG_ZIGZAG_PCT))
+    return entry[2]
+
 def enforce_leg_filter(parsed: dict, msg: dict):
-    if not LEG_FILTER: return
+    if not LEG_FILTER or not LEG_CAN_REJECT: return
     tf = find_timeframe_in_msg(msg)
     interval = TF_MAP.get(tf, TF_MAP[LEG_TIMEFRAME_DEFAULT])
-    market_base = market_base_for_data(parsed["base"])
+    market_base = parsed["market_base"]
     try:
-        kl = fetch_klines_binance_spot(market_base, "USDT", interval, min(LEG_MAX_LOOKBACK, 600))
-        closes = [c for (_,_,_,c) in kl]
-        piv = zigzag_pivots(closes, LEG_ZIGZAG_PCT)
-        trend, leg_idx = infer_trend_and_leg(closes, piv)
+        trend, leg_idx = leg_analysis_cached(market_base, "USDT", interval, min(LEG_MAX_LOOKBACK, 600))
         if LEG_REQUIRE_TREND_MATCH and trend in ("up","down"):
             if parsed["side"]=="long" and trend!="up":   raise SkipSignal(f"Trend-Mismatch: long vs {trend}")
             if parsed["side"]=="short" and trend!="down":raise SkipSignal(f"Trend-Mismatch: short vs {trend}")
         # nur Leg 1–LEG_MAX erlauben
         if leg_idx > LEG_MAX:
             raise SkipSignal(f"Leg-Filter: aktueller Leg {leg_idx} > {LEG_MAX} ({trend})")
-        print(f"[LEG] tf={tf} interval={interval} trend={trend} leg={leg_idx} base={market_base}")
+        log.info(f"[LEG] tf={tf} interval={interval} trend={trend} leg={leg_idx} base={market_base}")
     except SkipSignal: raise
     except Exception as ex:
         msg_txt = f"Leg-Filter Fehler: {ex.__class__.__name__}: {ex}"
         if LEG_FAIL_MODE=="skip": raise SkipSignal(msg_txt)
-        else: print(f"[LEG WARN] {msg_txt} → FAIL-OPEN")
+        else: log.warning(f"[LEG WARN] {msg_txt} → FAIL-OPEN")
 
 # =========================
 # Prices (Spot & Futures)
 # =========================
 
-def binance_spot_symbol(base: str) -> str:
-    return f"{market_base_for_data(base)}USDT"
-
-def binance_futures_symbol(base: str) -> str:
-    return f"{market_base_for_data(base)}USDT"
-
-def fetch_last_price_spot(base: str) -> float:
-    sym = binance_spot_symbol(base)
+def fetch_last_price_spot(sym: str) -> float:
     url = "https://api.binance.com/api/v3/ticker/price"
-    r = requests.get(url, params={"symbol": sym}, timeout=8)
+    r = SESSION.get(url, params={"symbol": sym}, timeout=(CONNECT_TIMEOUT, 8))
     r.raise_for_status()
-    return float(r.json()["price"])
+    return float(orjson.loads(r.content)["price"])
 
-def fetch_last_price_futures(base: str) -> float:
-    sym = binance_futures_symbol(base)
+def fetch_last_price_futures(sym: str) -> float:
     url = "https://fapi.binance.com/fapi/v1/ticker/price"
-    r = requests.get(url, params={"symbol": sym}, timeout=8)
+    r = SESSION.get(url, params={"symbol": sym}, timeout=(CONNECT_TIMEOUT, 8))
     r.raise_for_status()
-    return float(r.json()["price"])
+    return float(orjson.loads(r.content)["price"])
+
+# Parallele Touch-Waits auf dasselbe Symbol teilen sich einen Futures-Poll (sym -> (ts, preis))
+_FUT_PRICES: dict[str, tuple[float, float]] = {}
+
+def fetch_last_price_futures_shared(sym: str, max_age: float) -> float:
+    now = time.monotonic()
+    hit = _FUT_PRICES.get(sym)
+    if hit and now - hit[0] < max_age:
+        return hit[1]
+    price = fetch_last_price_futures(sym)
+    _FUT_PRICES[sym] = (now, price)
+    return price
 
 # =========================
 # Altrady Payload
 # =========================
 
+# Statische Felder einmal vorbelegen; Platzhalter halten die Key-Reihenfolge stabil
+# Read-only: .copy() liefert pro Signal ein normales dict, die Vorlage selbst bleibt unveränderlich
+_PAYLOAD_TEMPLATE = MappingProxyType({
+    "api_key": ALTRADY_API_KEY,
+    "api_secret": ALTRADY_API_SECRET,
+    "exchange": ALTRADY_EXCHANGE,
+    "action": "open",
+    "symbol": None,
+    "side": None,
+    "order_type": "limit",
+    "leverage": None,
+    "take_profit": None,
+    "stop_loss": None,
+    "entry_expiration": {"time": ENTRY_EXPIRATION_MIN},
+})
+
 def build_altrady_payload(parsed: dict, order_type: str = "limit") -> dict:
-    payload = {
-        "api_key": ALTRADY_API_KEY,
-        "api_secret": ALTRADY_API_SECRET,
-        "exchange": ALTRADY_EXCHANGE,
-        "action": "open",
-        "symbol": parsed["symbol"],
-        "side": parsed["side"],
-        "order_type": order_type,
-        "leverage": parsed["leverage"],
-        "take_profit": [
-            {"price": parsed["tp1"], "position_percentage": TP1_PCT},
-            {"price": parsed["tp2"], "position_percentage": TP2_PCT}
-        ],
-        "stop_loss": {"stop_price": parsed["sl"], "protection_type": "BREAK_EVEN"},
-        "entry_expiration": {"time": ENTRY_EXPIRATION_MIN}
-    }
+    payload = _PAYLOAD_TEMPLATE.copy()
+    payload["symbol"] = parsed["symbol"]
+    payload["side"] = parsed["side"]
+    payload["order_type"] = order_type
+    payload["leverage"] = parsed["leverage"]
+    payload["take_profit"] = [
+        {"price": parsed["tp1"], "position_percentage": TP1_PCT},
+        {"price": parsed["tp2"], "position_percentage": TP2_PCT}
+    ]
+    payload["stop_loss"] = {"stop_price": parsed["sl"], "protection_type": "BREAK_EVEN"}
     if order_type == "limit":
         payload["signal_price"] = parsed["entry"]
     return payload
@@ -397,6 +619,11 @@ def apply_basis_adjust_once(parsed: dict, spot_last: float, fut_last: float):
     if BASIS_MODE != "adjust": return parsed  # no change
     if spot_last <= 0 or fut_last <= 0: return parsed
     factor = clamp_adj_factor(fut_last/spot_last, BASIS_MAX_PCT)
+    # Level liegen schon im Tick-Raster: verschiebt der Faktor selbst das größte Level um
+    # < ~halben Tick, rundet round_tick exakt auf die Eingangswerte zurück → nichts zu tun
+    p = TICK_FACTORS.get(parsed["base"], TICK_FACTOR_DEFAULT)
+    if max(parsed["entry"], parsed["tp1"], parsed["tp2"], parsed["sl"]) * abs(factor - 1.0) * p < 0.45:
+        return parsed
     adj = dict(parsed)
     adj["entry"] = round_tick(parsed["base"], parsed["entry"] * factor)
     adj["tp1"]   = round_tick(parsed["base"], parsed["tp1"]   * factor)
@@ -404,93 +631,143 @@ def apply_basis_adjust_once(parsed: dict, spot_last: float, fut_last: float):
     adj["sl"]    = round_tick(parsed["base"], parsed["sl"]    * factor)
     return adj
 
-def should_wait_for_touch(side: str, fut_last: float, entry: float, tol_abs: float) -> bool:
+def touch_predicate(side: str, entry: float, tol_abs: float):
+    # Trigger-Level + Vergleich einmal festlegen: Long touched ab >= entry-tol, Short ab <= entry+tol
     if side == "long":
-        return fut_last < (entry - tol_abs)
-    else:
-        return fut_last > (entry + tol_abs)
+        trigger = entry - tol_abs
+        return lambda price: price >= trigger
+    trigger = entry + tol_abs
+    return lambda price: price <= trigger
 
-def wait_for_touch_and_send(parsed_in: dict) -> bool:
+def wait_for_touch_and_send(parsed_in: dict, idem_key: str | None = None, expires_at: float | None = None) -> bool:
     base  = parsed_in["base"]
     side  = parsed_in["side"]
+    sym   = parsed_in["binance_symbol"]
 
-    # Live-Preise
+    # Live-Preise (Spot nur für Basis-Adjust nötig → parallel zum Futures-Call)
     try:
-        spot_last = fetch_last_price_spot(base)
-        fut_last  = fetch_last_price_futures(base)
+        if BASIS_MODE == "adjust":
+            spot_job  = IO_POOL.submit(fetch_last_price_spot, sym)
+            fut_last  = fetch_last_price_futures(sym)
+            spot_last = spot_job.result()
+        else:
+            fut_last  = fetch_last_price_futures(sym)
     except Exception as ex:
-        print(f"[TOUCH] Preis-Error {base}: {ex} → FAIL-OPEN Limit @ Entry (ohne Adjust)")
+        log.warning(f"[TOUCH] Preis-Error {base}: {ex} → FAIL-OPEN Limit @ Entry (ohne Adjust)")
         payload = build_altrady_payload(parsed_in, order_type="limit")
-        post_to_altrady(payload)
+        post_to_altrady(payload, idem_key)
         return True
 
     # Optional: Basis-Adjust (Spot→Futures)
-    parsed = apply_basis_adjust_once(parsed_in, spot_last, fut_last) if BASIS_MODE=="adjust" else dict(parsed_in)
+    parsed = apply_basis_adjust_once(parsed_in, spot_last, fut_last) if BASIS_MODE=="adjust" else parsed_in
 
     entry = parsed["entry"]
     tol_abs = entry * (ENTRY_TOL_PCT/100.0)
+    touched = touch_predicate(side, entry, tol_abs)
 
     # Sofort oder warten?
-    if not should_wait_for_touch(side, fut_last, entry, tol_abs):
-        print(f"[TOUCH] Kein Warten nötig ({base}) fut={fut_last} entry={entry}")
+    if touched(fut_last):
+        log.info(f"[TOUCH] Kein Warten nötig ({base}) fut={fut_last} entry={entry}")
         payload = build_altrady_payload(parsed, order_type="limit")
-        post_to_altrady(payload)
+        post_to_altrady(payload, idem_key)
         return True
 
     # Warten bis Touch (Futures)
-    print(f"[TOUCH] Warten auf Futures-Touch ({base}) fut={fut_last} entry={entry} tol={tol_abs:.10f}...")
-    t0 = time.time()
-    while time.time() - t0 <= ENTRY_WAIT_MAX_SEC:
-        time.sleep(max(0.5, ENTRY_POLL_SEC))
+    otype = ENTRY_TOUCH_ORDER_TYPE if ENTRY_TOUCH_ORDER_TYPE in ("market","limit") else "limit"
+    log.info(f"[TOUCH] Warten auf Futures-Touch ({base}) fut={fut_last} entry={entry} tol={tol_abs:.10f}...")
+    # Feste Poll-Taktung auf der monotonen Uhr: Request-Latenz verlängert das Intervall nicht,
+    # Uhrsprünge (NTP) verkürzen/verlängern den Timeout nicht
+    poll = max(0.5, ENTRY_POLL_SEC)
+    deadline = time.monotonic() + ENTRY_WAIT_MAX_SEC
+    if expires_at is not None:
+        # nie über SIGNAL_MAX_AGE_SEC ab Post-Zeit hinaus warten (Wanduhr einmal in monoton umrechnen)
+        deadline = min(deadline, time.monotonic() + expires_at - time.time())
+    next_poll = time.monotonic() + poll
+    while next_poll <= deadline:
+        if STOP.wait(max(0.0, next_poll - time.monotonic())):
+            log.info(f"[TOUCH] Abbruch ({base}) – Shutdown.")
+            return False
+        next_poll += poll
         try:
-            fut_last = fetch_last_price_futures(base)
+            fut_last = fetch_last_price_futures_shared(sym, poll / 2)
         except Exception as ex:
-            print(f"[TOUCH] Futures-Preis-Error ({base}): {ex}")
+            log.warning(f"[TOUCH] Futures-Preis-Error ({base}): {ex}")
             continue
 
-        if side == "long":
-            if fut_last >= (entry - tol_abs):
-                print(f"[TOUCH] LONG Touch ({base}) fut={fut_last} ~ entry={entry}")
-                otype = ENTRY_TOUCH_ORDER_TYPE if ENTRY_TOUCH_ORDER_TYPE in ("market","limit") else "limit"
-                payload = build_altrady_payload(parsed, order_type=otype)
-                post_to_altrady(payload)
-                return True
-        else:
-            if fut_last <= (entry + tol_abs):
-                print(f"[TOUCH] SHORT Touch ({base}) fut={fut_last} ~ entry={entry}")
-                otype = ENTRY_TOUCH_ORDER_TYPE if ENTRY_TOUCH_ORDER_TYPE in ("market","limit") else "limit"
-                payload = build_altrady_payload(parsed, order_type=otype)
-                post_to_altrady(payload)
-                return True
-
-    print(f"[TOUCH] Timeout ({base}) – Entry nicht erreicht.")
+        if touched(fut_last):
+            log.info(f"[TOUCH] {side.upper()} Touch ({base}) fut={fut_last} ~ entry={entry}")
+            payload = build_altrady_payload(parsed, order_type=otype)
+            post_to_altrady(payload, idem_key)
+            return True
+
+    log.info(f"[TOUCH] Timeout ({base}) – Entry nicht erreicht.")
     return False
 
 # =========================
 # Send to Altrady
 # =========================
 
-def post_to_altrady(payload: dict):
-    for attempt in range(3):
-        try:
-            r = requests.post(ALTRADY_WEBHOOK_URL, json=payload, timeout=20)
-            if r.status_code == 429:
-                delay = 2.0
-                try: delay = float(r.json().get("retry_after", 2.0))
-                except Exception: pass
-                time.sleep(delay + 0.25); continue
-            r.raise_for_status()
-            return r
-        except Exception:
-            if attempt == 2: raise
-            time.sleep(1.5*(attempt+1))
+def post_to_altrady(payload: dict, idem_key: str | None = None):
+    # Gleicher Key für alle Retries (Adapter sendet die Header unverändert erneut) → Altrady kann
+    # einen nach Timeout wiederholten POST als Duplikat erkennen statt doppelt zu ordern
+    headers = {**JSON_HEADERS, "Idempotency-Key": idem_key} if idem_key else JSON_HEADERS
+    r = SESSION.post(ALTRADY_WEBHOOK_URL, data=orjson.dumps(payload), headers=headers, timeout=(CONNECT_TIMEOUT, 20))
+    r.raise_for_status()
+    return r
 
 # =========================
 # MAIN
 # =========================
 
+def handle_block(idx: int, raw_text: str, msg: dict, state: dict, expires_at: float):
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug(f"[DBG] Block {idx}: {WHITESPACE.sub(' ', raw_text)[:160]!r}")
+    # Block kann hinter belegten Workern (Touch-Waits) lange gewartet haben
+    if time.time() >= expires_at:
+        log.info(f"⏭️ Block {idx} übersprungen: Signal älter als {SIGNAL_MAX_AGE_SEC}s.")
+        return
+    try:
+        parsed = parse_signal_text(raw_text)
+        # Key aus Message-ID + Signal (vor Basis-Adjust) → stabil über Retries und Neustarts
+        idem_key = hashlib.sha1(
+            f"{msg.get('id')}|{parsed['symbol']}|{parsed['side']}|{parsed['entry']}".encode()
+        ).hexdigest()
+        # Nach Neustart mit veraltetem last_id: schon gesendete Orders nicht erneut posten
+        if idem_key in state.get("sent", ()):
+            log.info(f"[cache hit] Block {idx} bereits gesendet: {parsed['symbol']} {parsed['side']}")
+            return
+        enforce_leg_filter(parsed, msg)
+    except SkipSignal as sk:
+        log.info(f"⏭️ Block {idx} übersprungen: {sk}")
+        return
+    except ParseError as pex:
+        log.warning(f"[PARSE ERROR] Block {idx}: {pex}"); return
+    except Exception:
+        log.exception(f"[ERROR] Block {idx} – unerwartet:"); return
+    else:
+        ok = wait_for_touch_and_send(parsed, idem_key, expires_at)
+        if ok:
+            # sofort persistieren: ein Crash während anderer Touch-Waits darf die Order nicht vergessen
+            with STATE_LOCK:
+                sent = state.setdefault("sent", [])
+                sent.append(idem_key)
+                del sent[:-SENT_CACHE_MAX]
+                save_state(state)
+            log.info(f"✅ Order platziert | {parsed['symbol']} | {parsed['side']} | entry={parsed['entry']} | lev={parsed['leverage']} | TP%={TP1_PCT}/{TP2_PCT}")
+        else:
+            log.info("🚫 Kein Entry – Touch nicht erfolgt.")
+
+def request_stop(signum, frame):
+    log.info(f"{signal.Signals(signum).name} empfangen – beende nach laufendem Schritt.")
+    # Nicht direkt STOP.set(): der Handler läuft im Main-Thread, der evtl. gerade in STOP.wait den
+    # (nicht reentranten) Lock des Events hält → Deadlock. Kurzlebiger Thread setzt das Flag.
+    threading.Thread(target=STOP.set, name="stop", daemon=True).start()
+
 def main():
-    print(
+    # SIGTERM (docker stop/systemd) wie Ctrl-C behandeln: kein Abbruch mitten in save_state
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+    log.info(
         "➡️ Exch:{ex} | Quote:{q} | MaxLev:{ml} | Safety%:{s} | TP%:{t1}/{t2} | Exp:{exp}m | "
         "Leg: {lf} max={lmax} zigzag={zz}% lookback={lb} trend={tm} | "
         "Touch: wait={wait}s poll={poll}s tol={tol}% type={otype} | Basis:{basis} cap={bcap}%".format(
@@ -502,55 +779,97 @@ def main():
             otype=ENTRY_TOUCH_ORDER_TYPE.upper(), basis=BASIS_MODE.upper(), bcap=BASIS_MAX_PCT
         )
     )
-    state = load_state(); last_id = state.get("last_id")
-
-    while True:
+    try:
+        poll_loop()
+    finally:
+        # Keep-Alive-Verbindungen (Discord/Binance/Altrady) sauber schließen statt sie beim Exit abzureißen
+        SESSION.close()
+
+def poll_loop():
+    state = load_state()
+    # Snowflake-ID einmal als int halten statt pro Poll zweimal zu parsen
+    last_id_int = int(state.get("last_id") or -1)
+    # Wiederholte Fehler (Netz weg, falscher Key): Traceback nur beim ersten Auftreten pro
+    # 10-Minuten-Fenster, danach eine Zähler-Zeile pro Tick
+    err_seen: dict[tuple[str, str], int] = {}
+    err_reset = time.monotonic() + 600
+
+    while not STOP.is_set():
         try:
-            msg = fetch_latest_message(CHANNEL_ID)
-            if msg:
-                mid = msg.get("id")
-                if last_id is None or int(mid) > int(last_id):
-                    blocks = extract_signal_blocks(msg)
-                    if not blocks:
-                        print("[skip] keine erkennbaren Signal-Blöcke.")
-                        last_id = mid; state["last_id"]=last_id; save_state(state)
-                    else:
-                        print(f"[INFO] {len(blocks)} Signal-Block(s) gefunden.")
-                        for idx, raw_text in enumerate(blocks, start=1):
-                            dbg = re.sub(r"\s+"," ", raw_text)[:160]
-                            print(f"[DBG] Block {idx}: {dbg!r}")
-                            try:
-                                parsed = parse_signal_text(raw_text)
-                                enforce_leg_filter(parsed, msg)
-                            except SkipSignal as sk:
-                                print(f"[{datetime.now().strftime('%H:%M:%S')}] ⏭️ Block {idx} übersprungen: {sk}")
-                                continue
-                            except AssertionError as aex:
-                                print(f"[PARSE ERROR] Block {idx}: {aex}"); continue
-                            except Exception:
-                                print(f"[ERROR] Block {idx} – unerwartet:"); traceback.print_exc(); continue
-                            else:
-                                ok = wait_for_touch_and_send(parsed)
-                                ts = datetime.now().strftime("%H:%M:%S")
-                                if ok:
-                                    print(f"[{ts}] ✅ Order platziert | {parsed['symbol']} | {parsed['side']} | entry={parsed['entry']} | lev={parsed['leverage']} | TP%={TP1_PCT}/{TP2_PCT}")
-                                else:
-                                    print(f"[{ts}] 🚫 Kein Entry – Touch nicht erfolgt.")
-                        last_id = mid; state["last_id"]=last_id; save_state(state)
+            if last_id_int < 0:
+                # Kaltstart ohne last_id: nur die neueste Message, keine Kanal-Historie nachholen
+                msg = fetch_latest_message(CHANNEL_ID)
+                msgs = [msg] if msg else []
+            else:
+                msgs = fetch_messages_after(CHANNEL_ID, last_id_int)
+            if msgs:
+                # Blöcke aller neuen Messages parallel (in Eingangsreihenfolge eingereiht):
+                # ein Touch-Wait (bis ENTRY_WAIT_MAX_SEC) blockiert die anderen nicht
+                jobs = []
+                n_skipped = 0
+                # Repost-Erkennung: Hash + ID der Message, die ihn gesetzt hat. Erst nach dem Batch
+                # (zusammen mit last_id) persistiert, sonst verwirft ein Retry der gleichen Message sich selbst
+                text_hash, text_id = state.get("last_text_hash"), int(state.get("last_text_id") or -1)
+                for msg in msgs:
+                    blocks = list(iter_signal_blocks(msg))
+                    if not blocks: continue
+                    # Nach Downtime nachgeholte Signale: Preis ist längst weitergelaufen, ein sofortiger
+                    # Touch würde zum aktuellen Kurs handeln → überspringen, last_id läuft trotzdem weiter
+                    expires_at = message_time(msg["id"]) + SIGNAL_MAX_AGE_SEC
+                    if time.time() >= expires_at:
+                        age = time.time() - message_time(msg["id"])
+                        log.info(f"[skip] Message {msg['id']}: Signal {age:.0f}s alt (> {SIGNAL_MAX_AGE_SEC}s).")
+                        n_skipped += 1; continue
+                    # Editierte/erneut gepostete Signale kommen mit neuer ID: gleicher Blocktext wie
+                    # das zuletzt verarbeitete Signal → nicht nochmal parsen/ordern. Nur innerhalb von
+                    # SIGNAL_MAX_AGE_SEC (Snowflake-Abstand): später ist gleicher Text ein neues Signal
+                    h = hashlib.blake2b("\n\n".join(blocks).encode(), digest_size=16).hexdigest()
+                    mid = int(msg["id"])
+                    if h == text_hash and mid > text_id and ((mid - text_id) >> 22) / 1000 < SIGNAL_MAX_AGE_SEC:
+                        log.info(f"[skip] Message {msg['id']}: gleicher Signaltext wie zuvor (Repost).")
+                        n_skipped += 1; continue
+                    text_hash, text_id = h, mid
+                    jobs += [BLOCK_POOL.submit(handle_block, idx, raw_text, msg, state, expires_at)
+                             for idx, raw_text in enumerate(blocks, start=1)]
+                # Erst ALLE Blöcke abwarten, dann Fehler weiterreichen: sonst holt der nächste Tick die
+                # Message erneut und reicht Blöcke ein, die noch im Touch-Wait stecken (Doppel-Order)
+                wait_futures(jobs)
+                for job in jobs: job.result()
+                # Stop während Touch-Waits: last_id nicht vorziehen → abgebrochene Blöcke laufen nach
+                # dem Neustart erneut (bereits gesendete fängt der Sent-Cache ab)
+                if STOP.is_set(): break
+                n_blocks = len(jobs)
+                if n_blocks:
+                    log.info(f"[INFO] {n_blocks} Signal-Block(s) aus {len(msgs)} Message(s) verarbeitet.")
+                elif n_skipped:
+                    log.info(f"[skip] keine neuen Signal-Blöcke ({len(msgs)} Message(s), {n_skipped} übersprungen).")
                 else:
-                    print(f"[{datetime.now().strftime('%H:%M:%S')}] Keine neuere Nachricht.")
+                    log.info(f"[skip] keine erkennbaren Signal-Blöcke ({len(msgs)} Message(s)).")
+                # last_id (+ Repost-Hash) einmal pro Batch persistieren
+                last_id_int = int(msgs[-1]["id"])
+                with STATE_LOCK:
+                    state["last_id"]=msgs[-1]["id"]
+                    if text_hash is not None:
+                        state["last_text_hash"], state["last_text_id"] = text_hash, str(text_id)
+                    save_state(state)
             else:
-                print(f"[{datetime.now().strftime('%H:%M:%S')}] Kanal leer.")
-        except KeyboardInterrupt:
-            print("\nStopped."); break
+                log.debug("Kanal leer." if last_id_int < 0 else "Keine neuere Nachricht.")
         except requests.HTTPError as http_err:
             body = ""
             try: body = http_err.response.text[:200]
             except Exception: pass
-            print("[HTTP ERROR]", http_err.response.status_code, body or "")
-        except Exception:
-            print("[ERROR]"); traceback.print_exc()
+            # gestreamte Discord-Antworten: Body steckt bereits in der Exception-Meldung
+            if body: log.error(f"[HTTP ERROR] {http_err.response.status_code} {body}")
+            else:    log.error(f"[HTTP ERROR] {http_err}")
+        except Exception as ex:
+            if time.monotonic() >= err_reset:
+                err_seen.clear(); err_reset = time.monotonic() + 600
+            key = (type(ex).__name__, str(ex)[:120])
+            n = err_seen[key] = err_seen.get(key, 0) + 1
+            if n == 1: log.exception("[ERROR]")
+            else: log.error(f"[ERROR×{n}] {key[0]}: {key[1]}")
         sleep_until_next_tick()
+    log.info("Stopped.")
 
 if __name__ == "__main__":
     main()